@@ -1,12 +1,9 @@
-from config import config
+from config import get_config
 from datetime import datetime
 from dotenv import dotenv_values
-from httpx import ReadTimeout
+import functools
 import io
 from enum import Enum
-from google import genai
-from google.genai import types
-from google.genai.errors import ClientError, ServerError
 from hashlib import md5
 import os
 from pathlib import Path
@@ -15,8 +12,18 @@ from typing import List
 from exceptions import ExceptionMonitor, retry_with_backoff, skip_silently
 
 
-secrets = dotenv_values(config.secrets_file)
-GEMINI_API_KEY = secrets["GEMINI_API_KEY"]
+# The SDK and its httpx stack take most of a second to import, so they are only
+# imported once an API call is actually made, or preloaded by a forkserver.
+SDK_MODULES = ["httpx", "google.genai", "google.genai.types", "google.genai.errors"]
+
+
+@functools.lru_cache(maxsize=None)
+def get_api_key():
+    secrets_file = get_config().secrets_file
+    secrets = dotenv_values(secrets_file)
+    if not secrets.get("GEMINI_API_KEY"):
+        raise KeyError(f"GEMINI_API_KEY is not set in {secrets_file}")
+    return secrets["GEMINI_API_KEY"]
 
 
 class GEMINI_AVAILABLE_MODELS(Enum):
@@ -25,6 +32,8 @@ class GEMINI_AVAILABLE_MODELS(Enum):
 
 
 def _is_file_size_exceeded(e: Exception):
+    from google.genai.errors import ClientError
+
     return (
         isinstance(e, ClientError)
         and e.code == 400
@@ -36,6 +45,8 @@ def _is_file_size_exceeded(e: Exception):
 
 
 def _is_server_overloaded(e: Exception):
+    from google.genai.errors import ServerError
+
     return (
         isinstance(e, ServerError)
         and e.code == 503
@@ -44,6 +55,8 @@ def _is_server_overloaded(e: Exception):
 
 
 def _is_file_io_timeout(e: Exception):
+    from httpx import ReadTimeout
+
     return isinstance(e, ReadTimeout)
 
 
@@ -51,9 +64,39 @@ def _is_retryable(e: Exception):
     return _is_server_overloaded(e) or _is_file_io_timeout(e)
 
 
+def get_cache_key(
+    prompt: str,
+    system_prompt: str = None,
+    attachments: List[Path] | List[io.BytesIO] = [],
+    max_tokens: int = None,
+):
+    key = md5(prompt.encode())
+    if system_prompt:
+        key.update(system_prompt.encode())
+    for attachment in attachments:
+        key.update(attachment.read())
+        if isinstance(
+            attachment, io.BytesIO
+        ):  # https://github.com/farhanhubble/jfk-tell/issues/1
+            attachment.seek(0)
+    if max_tokens:
+        key.update(str(max_tokens).encode())
+    return key.hexdigest()
+
+
 class GeminiClient:
-    def __init__(self, model: GEMINI_AVAILABLE_MODELS, use_local_cache: bool = False):
-        self._client = genai.Client(api_key=GEMINI_API_KEY)
+    def __init__(
+        self,
+        model: GEMINI_AVAILABLE_MODELS,
+        use_local_cache: bool = False,
+        cache_dir: Path = None,
+        fallback_cache_dir: Path = None,
+    ):
+        """
+        :param cache_dir: Where responses are cached, defaults to `extraction.cache_dir`.
+        :param fallback_cache_dir: A read-only cache consulted on a miss in `cache_dir`.
+        """
+        self._sdk_client = None
         if model not in GEMINI_AVAILABLE_MODELS:
             raise ValueError(
                 f"Model {model} not available. Choose from {[k for k in GEMINI_AVAILABLE_MODELS]}"
@@ -61,9 +104,19 @@ class GeminiClient:
         self._model = model
         self._use_local_cache = use_local_cache
         if use_local_cache:
-            self._cache_dir = config.extraction.cache_dir
+            self._cache_dir = cache_dir or get_config().extraction.cache_dir
             if not self._cache_dir.exists():
                 self._cache_dir.mkdir(parents=True)
+            self._fallback_cache_dir = fallback_cache_dir
+
+    @property
+    def _client(self):
+        # Created on the first cache miss, then reused for the client's lifetime
+        if self._sdk_client is None:
+            from google import genai
+
+            self._sdk_client = genai.Client(api_key=get_api_key())
+        return self._sdk_client
 
     @ExceptionMonitor(error_rate_threshold=0.03, min_calls=100)
     @retry_with_backoff([30, 60], when=_is_retryable)
@@ -76,26 +129,19 @@ class GeminiClient:
         max_tokens: int = None,
     ):
 
-        def _get_cache_key():
-            key = md5(prompt.encode())
-            if system_prompt:
-                key.update(system_prompt.encode())
-            for attachment in attachments:
-                key.update(attachment.read())
-                if isinstance(
-                    attachment, io.BytesIO
-                ):  # https://github.com/farhanhubble/jfk-tell/issues/1
-                    attachment.seek(0)
-            if max_tokens:
-                key.update(str(max_tokens).encode())
-            return key.hexdigest()
-
         if self._use_local_cache:
-            cache_key = _get_cache_key()
+            cache_key = get_cache_key(prompt, system_prompt, attachments, max_tokens)
             cache_file = self._cache_dir / f"{cache_key}"
             if cache_file.exists():
                 with open(cache_file, "r") as f:
                     return f.read()
+            if self._fallback_cache_dir:
+                fallback_file = self._fallback_cache_dir / f"{cache_key}"
+                if fallback_file.exists():
+                    with open(fallback_file, "r") as f:
+                        return f.read()
+
+        from google.genai import types
 
         attached_files = []
         for attachment in attachments:
@@ -115,14 +161,17 @@ class GeminiClient:
             ),
         )
 
+        # An empty response is a valid result, unlike the `None` returned when
+        # `ExceptionMonitor` swallows an error
+        text = response.text or "```markdown\n\n```"
         if self._use_local_cache:
             temp_file = tempfile.NamedTemporaryFile(delete=False, dir=self._cache_dir)
             try:
                 with open(temp_file.name, "w") as f:
-                    f.write(response.text or "```markdown\n\n```")
+                    f.write(text)
                 os.replace(temp_file.name, cache_file)
             finally:
                 if os.path.exists(temp_file.name):
                     os.remove(temp_file.name)
 
-        return response.text
+        return text
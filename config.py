@@ -1,6 +1,8 @@
+import functools
 import json
 from pydantic import BaseModel, RootModel, Field
 from pathlib import Path
+from typing import Literal
 
 
 class BaseConfigClass(BaseModel):
@@ -25,6 +27,18 @@ class EXTRACTION_CONFIG(BaseConfigClass):
         ..., description="Include LLM-generated remarks in the extracted document"
     )
     cache_dir: Path
+    sink: Literal["files", "jsonl", "parquet"] = Field(
+        "files",
+        description="Write one file per document, or append to JSONL/Parquet shards",
+    )
+    max_shard_bytes: int = Field(
+        256 * 1024 * 1024, description="Uncompressed text size at which a shard is closed"
+    )
+    worker_start_method: Literal["fork", "forkserver", "spawn"] = Field(
+        "fork",
+        description="How worker processes are started; 'forkserver' imports the "
+        "Gemini SDK once and shares it with every worker",
+    )
 
 
 class Config(BaseConfigClass):
@@ -33,9 +47,19 @@ class Config(BaseConfigClass):
     extraction: EXTRACTION_CONFIG = Field(..., description="Extraction configuration")
 
 
-with open(".config/default.json", "r") as f:
-    config = Config(**json.load(f))
+@functools.lru_cache(maxsize=None)
+def get_config(config_file: str = ".config/default.json") -> Config:
+    """Parse the config file on first use, not at import time."""
+    with open(config_file, "r") as f:
+        return Config(**json.load(f))
+
+
+def __getattr__(name):
+    # Keep `from config import config` working, loading the file on demand
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    print(config.model_dump_json(indent=2))
+    print(get_config().model_dump_json(indent=2))
@@ -1,11 +1,21 @@
 from _logging import logger
-from ai.google import GeminiClient, GEMINI_AVAILABLE_MODELS
-from config import config
+from ai.google import (
+    GeminiClient,
+    GEMINI_AVAILABLE_MODELS,
+    SDK_MODULES,
+    get_api_key,
+)
+from config import get_config
 import io
-from multiprocessing import Pool
+import multiprocessing
 from pathlib import Path
 from pypdf import PdfReader, PdfWriter
+from sharding import merge_shards, parse_shard, shard_dir, shard_of
+from sink import ShardSink, make_sink
 from tqdm import tqdm
+from typer import Context, Option, Typer
+
+app = Typer()
 
 
 def _model_from_name(name: str) -> GEMINI_AVAILABLE_MODELS:
@@ -29,6 +39,16 @@ def _parse_markdown(response: str):
     return md_content
 
 
+def _source_id(pdf_file: Path, year: str):
+    """Identifies a source PDF for shard assignment, independent of output settings."""
+    return f"{year}/{pdf_file.name}"
+
+
+def _doc_id(pdf_file: Path, year: str):
+    file_ext = ".txt" if get_config().extraction.include_annotation else ".md"
+    return f"{year}/{pdf_file.with_suffix(file_ext).name}"
+
+
 def _load_pdf_pages(pdf_file: Path):
     pdf_data = PdfReader(pdf_file)
     for i, page in enumerate(pdf_data.pages):
@@ -47,8 +67,15 @@ class Extractor:
         prompt_file: Path,
         system_prompt_file: Path = None,
         max_tokens: int = None,
+        cache_dir: Path = None,
+        fallback_cache_dir: Path = None,
     ):
-        self.client = GeminiClient(model, use_local_cache=True)
+        self.client = GeminiClient(
+            model,
+            use_local_cache=True,
+            cache_dir=cache_dir,
+            fallback_cache_dir=fallback_cache_dir,
+        )
         with open(prompt_file, "r") as f:
             self.prompt = f.read()
         if system_prompt_file:
@@ -61,106 +88,203 @@ class Extractor:
     def extract_single_file(
         self,
         src: Path,
-        tgt_dir: Path,
     ):
+        """Returns `None` if any page failed, so the document can be retried."""
         pages = list(_load_pdf_pages(src))
         extracted_raw = []
         for page in pages:
-            extracted_raw.append(self.extract_single_page(page))
+            raw = self.extract_single_page(page)
+            if raw is None:
+                return None
+            extracted_raw.append(raw)
 
-        if config.extraction.include_annotation:
+        if get_config().extraction.include_annotation:
             content = "\n\n".join(extracted_raw)
         else:
             content = "\n\n".join(map(_parse_markdown, extracted_raw))
 
-        file_ext = ".txt" if config.extraction.include_annotation else ".md"
-        tgt = tgt_dir / src.with_suffix(file_ext).name
-        with open(tgt, "w") as f:
-            f.write(content or "")
+        return content or ""
 
     def extract_single_page(
         self,
         page: io.BytesIO,
     ):
-        raw = self.client.generate(
+        return self.client.generate(
             self.prompt, self.system_prompt, [page], self.max_tokens
         )
-        return raw or ""
 
 
-def _worker(
-    pdf_file: str,
-    target_dir: str,
+def _init_worker(
     model_name: str,
     prompt_file: str,
     system_prompt_file: str,
     max_tokens: int,
+    cache_dir: str = None,
+    fallback_cache_dir: str = None,
 ):
+    """Build the worker's `Extractor` once, to be reused for every file it gets."""
     global extractor
     extractor = Extractor(
         _model_from_name(model_name),
         Path(prompt_file),
         Path(system_prompt_file),
         max_tokens,
+        Path(cache_dir) if cache_dir else None,
+        Path(fallback_cache_dir) if fallback_cache_dir else None,
     )
-    extractor.extract_single_file(Path(pdf_file), Path(target_dir))
 
 
-def __worker_wrapper(args):
-    return _worker(*args)
+def _worker(pdf_file: str):
+    return extractor.extract_single_file(Path(pdf_file))
 
 
-def extract_all(
-    src_dir: Path,
-    target_dir: Path,
+def _make_pool(
     model_name: str,
     prompt_file: Path,
     system_prompt_file: Path = None,
     max_tokens: int = None,
+    cache_dir: Path = None,
+    fallback_cache_dir: Path = None,
 ):
-    logger.info(f"Extracting information from {src_dir} to {target_dir}")
+    start_method = get_config().extraction.worker_start_method
+    ctx = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        ctx.set_forkserver_preload(["__main__"] + SDK_MODULES)
+    return ctx.Pool(
+        32,
+        initializer=_init_worker,
+        initargs=(
+            model_name,
+            str(prompt_file),
+            str(system_prompt_file),
+            max_tokens,
+            str(cache_dir) if cache_dir else None,
+            str(fallback_cache_dir) if fallback_cache_dir else None,
+        ),
+    )
+
+
+def extract_all(
+    src_dir: Path,
+    sink,
+    pool,
+    shard: tuple = None,
+):
+    logger.info(f"Extracting information from {src_dir} to {sink.base_dir}")
     pdf_files = sorted(list(src_dir.glob("*.pdf")))
-    if not target_dir.exists():
-        target_dir.mkdir(parents=True)
-
-    with Pool(32) as pool:
-        list(
-            tqdm(
-                pool.imap(
-                    __worker_wrapper,
-                    [
-                        (
-                            str(pdf_file),
-                            str(target_dir),
-                            model_name,
-                            str(prompt_file),
-                            str(system_prompt_file),
-                            max_tokens,
-                        )
-                        for pdf_file in pdf_files
-                    ],
-                    chunksize=16,
-                ),
-                total=len(pdf_files),
-            )
+    if shard:
+        index, num_shards = shard
+        pdf_files = [
+            p
+            for p in pdf_files
+            if shard_of(_source_id(p, src_dir.name), num_shards) == index
+        ]
+    if isinstance(sink, ShardSink):
+        # Resume: skip documents already committed to a shard
+        pdf_files = [p for p in pdf_files if _doc_id(p, src_dir.name) not in sink]
+
+    results = tqdm(
+        pool.imap(
+            _worker,
+            [str(pdf_file) for pdf_file in pdf_files],
+            chunksize=16,
+        ),
+        total=len(pdf_files),
+    )
+    failed = 0
+    for pdf_file, content in zip(pdf_files, results):
+        if content is None:
+            failed += 1
+            continue
+        sink.write(_doc_id(pdf_file, src_dir.name), content)
+    if failed:
+        logger.warning(
+            f"{failed} documents in {src_dir} had failed pages and were not written, "
+            "see exceptions.log. Rerun to retry them."
         )
 
 
-if __name__ == "__main__":
+def _expected_shards(src_root: Path, num_shards: int):
+    """Map every document id to the shard its source PDF is assigned to."""
+    return {
+        _doc_id(pdf_file, src_subdir.name): shard_of(
+            _source_id(pdf_file, src_subdir.name), num_shards
+        )
+        for src_subdir in sorted(src_root.iterdir())
+        if src_subdir.is_dir()
+        for pdf_file in sorted(src_subdir.glob("*.pdf"))
+    }
+
+
+@app.callback(invoke_without_command=True)
+def main(
+    ctx: Context,
+    shard: str = Option(
+        None,
+        help="Extract only shard i of N, given as 'i/N'. Output and new cache entries go "
+        "to '<dir>.shard-i-of-N' next to the configured directories; the configured "
+        "cache is still read.",
+    ),
+):
+    """
+    Extract text from all downloaded PDFs.
+    """
+    if ctx.invoked_subcommand is not None:
+        return
+
+    config = get_config()
     SRC = config.extraction.src_dir
     DEST = config.extraction.dest_dir
+    CACHE_DIR = config.extraction.cache_dir
+    FALLBACK_CACHE_DIR = None
     MODEL = config.extraction.model_name
     PROMPT_FILE = config.extraction.prompt_file
     SYSTEM_PROMPT_FILE = config.extraction.system_prompt_file
     MAX_TOKENS = config.extraction.max_tokens
 
-    for src_subdir in SRC.iterdir():
-        if src_subdir.is_dir():
-            extract_all(
-                src_subdir,
-                DEST / src_subdir.name,
-                MODEL,
-                PROMPT_FILE,
-                SYSTEM_PROMPT_FILE,
-                MAX_TOKENS,
-            )
+    # Workers only read the key on a cache miss, where ExceptionMonitor would
+    # swallow the error, so check it up front
+    get_api_key()
+
+    shard_spec = parse_shard(shard) if shard else None
+    if shard_spec:
+        DEST = shard_dir(DEST, *shard_spec)
+        # New responses go to the shard's cache, existing ones are read from the
+        # canonical cache if it is present on this machine
+        FALLBACK_CACHE_DIR = CACHE_DIR
+        CACHE_DIR = shard_dir(CACHE_DIR, *shard_spec)
+        logger.info(f"Extracting shard {shard} into {DEST}")
+
+    with make_sink(
+        DEST, config.extraction.sink, config.extraction.max_shard_bytes
+    ) as sink, _make_pool(
+        MODEL,
+        PROMPT_FILE,
+        SYSTEM_PROMPT_FILE,
+        MAX_TOKENS,
+        CACHE_DIR,
+        FALLBACK_CACHE_DIR,
+    ) as pool:
+        for src_subdir in sorted(SRC.iterdir()):
+            if src_subdir.is_dir():
+                extract_all(src_subdir, sink, pool, shard_spec)
+
+
+@app.command()
+def merge(num_shards: int):
+    """
+    Verify and merge the outputs and caches of `--shard i/N` runs into the
+    configured extraction and cache directories.
+    """
+    config = get_config()
+    merge_shards(
+        _expected_shards(config.extraction.src_dir, num_shards),
+        config.extraction.dest_dir,
+        config.extraction.cache_dir,
+        num_shards,
+        config.extraction.sink,
+    )
+
+
+if __name__ == "__main__":
+    app()
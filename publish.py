@@ -4,6 +4,7 @@ from pathlib import Path
 from tqdm import tqdm
 import pyarrow as pa
 import pyarrow.parquet as pq
+from sink import SHARD_INDEX, SHARD_PREFIX
 from typing import Literal
 from typer import Typer
 
@@ -83,6 +84,23 @@ def publish_hf(parquet_path, repo_name):
     print(f"Uploaded {parquet_path} to {repo_name}")
 
 
+def publish_hf_shards(shard_dir, repo_name):
+    """Push the shards written by `sink.ShardSink` to Hugging Face Hub as-is.
+    Requires HF login via access token.
+    """
+    api = HfApi()
+    api.create_repo(repo_name, exist_ok=True, repo_type="dataset")
+
+    api.upload_folder(
+        folder_path=shard_dir,
+        repo_id=repo_name,
+        repo_type="dataset",
+        allow_patterns=[f"{SHARD_PREFIX}*", SHARD_INDEX],
+    )
+
+    print(f"Uploaded shards in {shard_dir} to {repo_name}")
+
+
 @app.command()
 def publish(
     dir_path: Path,
@@ -93,10 +111,19 @@ def publish(
 ):
     """
     Publish the contents of a directory to Hugging Face Hub as a Parquet file.
+    Directories of extraction shards are uploaded without rebuilding.
     """
     if content_type not in ["text", "binary"]:
         raise ValueError("content_type must be either 'text' or 'binary'")
 
+    if (dir_path / SHARD_INDEX).exists():
+        print(f"Found {SHARD_INDEX} in {dir_path}, publishing shards directly...")
+        if dry_run:
+            print("Dry run enabled. Not uploading to Hugging Face Hub.")
+        else:
+            publish_hf_shards(dir_path, repo_name)
+        return
+
     # Build the Parquet file
     build_parquet(
         dir_path,
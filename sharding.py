@@ -0,0 +1,169 @@
+"""Deterministic partitioning of extraction work across nodes"""
+
+from _logging import logger
+from collections import defaultdict
+from hashlib import md5
+import json
+from pathlib import Path
+import re
+import shutil
+from sink import SHARD_INDEX, SHARD_PREFIX, atomic_write
+from typing import Dict, List, Tuple
+
+_CACHE_KEY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parse a shard spec like `2/8` into `(2, 8)`."""
+    try:
+        index, num_shards = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must be given as 'i/N', got {spec!r}")
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError(f"Shard index must be in [0, {num_shards}), got {index}")
+    return index, num_shards
+
+
+def shard_of(doc_id: str, num_shards: int) -> int:
+    """Stable across machines and Python processes, unlike `hash()`."""
+    return int(md5(doc_id.encode()).hexdigest(), 16) % num_shards
+
+
+def shard_dir(base_dir: Path, index: int, num_shards: int) -> Path:
+    return base_dir.with_name(f"{base_dir.name}.shard-{index}-of-{num_shards}")
+
+
+def _shard_doc_ids(path: Path, sink_kind: str) -> List[str]:
+    if sink_kind == "files":
+        return [
+            str(f.relative_to(path)) for f in sorted(path.rglob("*")) if f.is_file()
+        ]
+    index_file = path / SHARD_INDEX
+    if not index_file.exists():
+        return []
+    with open(index_file, "r") as f:
+        return list(json.load(f))
+
+
+def verify_shards(
+    expected: Dict[str, int], dest_dir: Path, num_shards: int, sink_kind: str
+) -> Dict[int, List[str]]:
+    """Check that every expected document was extracted by exactly one shard,
+    the one it is assigned to in `expected`. Returns the document ids found in
+    each shard.
+    """
+    found = {}
+    for index in range(num_shards):
+        path = shard_dir(dest_dir, index, num_shards)
+        if not path.exists():
+            raise FileNotFoundError(f"Output of shard {index}/{num_shards} not found at {path}")
+        found[index] = _shard_doc_ids(path, sink_kind)
+
+    owners = defaultdict(list)
+    for index, doc_ids in found.items():
+        for doc_id in doc_ids:
+            owners[doc_id].append(index)
+
+    missing = sorted(expected.keys() - owners.keys())
+    duplicated = sorted(d for d, o in owners.items() if len(o) > 1)
+    misplaced = sorted(
+        d for d, o in owners.items() if d in expected and expected[d] not in o
+    )
+    unexpected = sorted(owners.keys() - expected)
+
+    if unexpected:
+        logger.warning(
+            f"{len(unexpected)} documents in shards have no source PDF, e.g. {unexpected[:5]}"
+        )
+    if missing or duplicated or misplaced:
+        raise RuntimeError(
+            f"Shard verification failed: {len(missing)} missing (e.g. {missing[:5]}), "
+            f"{len(duplicated)} duplicated (e.g. {duplicated[:5]}), "
+            f"{len(misplaced)} in the wrong shard (e.g. {misplaced[:5]})"
+        )
+    return found
+
+
+def _merge_file_shards(dest_dir: Path, num_shards: int):
+    for index in range(num_shards):
+        path = shard_dir(dest_dir, index, num_shards)
+        for src in path.rglob("*"):
+            if not src.is_file():
+                continue
+            tgt = dest_dir / src.relative_to(path)
+            if not tgt.parent.exists():
+                tgt.parent.mkdir(parents=True)
+            shutil.copy2(src, tgt)
+
+
+def _merge_dataset_shards(dest_dir: Path, num_shards: int):
+    merged_index_file = dest_dir / SHARD_INDEX
+    if merged_index_file.exists():
+        raise FileExistsError(
+            f"{merged_index_file} already exists, remove it and its shards before merging"
+        )
+    if not dest_dir.exists():
+        dest_dir.mkdir(parents=True)
+
+    merged_index = {}
+    count = 0
+    for index in range(num_shards):
+        path = shard_dir(dest_dir, index, num_shards)
+        if not (path / SHARD_INDEX).exists():
+            # The shard ran but committed no documents
+            continue
+        with open(path / SHARD_INDEX, "r") as f:
+            shard_index = json.load(f)
+        renamed = {}
+        for name in sorted(set(shard_index.values())):
+            renamed[name] = f"{SHARD_PREFIX}{count:05d}{Path(name).suffix}"
+            shutil.copy2(path / name, dest_dir / renamed[name])
+            count += 1
+        for doc_id, name in shard_index.items():
+            merged_index[doc_id] = renamed[name]
+
+    atomic_write(
+        merged_index_file,
+        lambda f: json.dump(merged_index, f, indent=2, sort_keys=True),
+    )
+
+
+def _merge_caches(cache_dir: Path, num_shards: int):
+    if not cache_dir.exists():
+        cache_dir.mkdir(parents=True)
+    copied = 0
+    for index in range(num_shards):
+        path = shard_dir(cache_dir, index, num_shards)
+        if not path.exists():
+            logger.warning(f"Cache of shard {index}/{num_shards} not found at {path}")
+            continue
+        for src in path.iterdir():
+            # Cache entries are content-addressed, so an existing key is identical
+            if not _CACHE_KEY_PATTERN.match(src.name):
+                continue
+            tgt = cache_dir / src.name
+            if not tgt.exists():
+                shutil.copy2(src, tgt)
+                copied += 1
+    logger.info(f"Copied {copied} new cache entries into {cache_dir}")
+
+
+def merge_shards(
+    expected: Dict[str, int],
+    dest_dir: Path,
+    cache_dir: Path,
+    num_shards: int,
+    sink_kind: str,
+):
+    """Verify per-shard outputs, then combine them and their caches into the
+    canonical `dest_dir` and `cache_dir`.
+    """
+    found = verify_shards(expected, dest_dir, num_shards, sink_kind)
+    logger.info(
+        f"Merging {sum(len(v) for v in found.values())} documents from {num_shards} shards into {dest_dir}"
+    )
+    if sink_kind == "files":
+        _merge_file_shards(dest_dir, num_shards)
+    else:
+        _merge_dataset_shards(dest_dir, num_shards)
+    _merge_caches(cache_dir, num_shards)
@@ -0,0 +1,160 @@
+"""Output sinks for extracted documents"""
+
+from _logging import logger
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Literal
+
+SHARD_INDEX = "index.json"
+SHARD_PREFIX = "shard-"
+
+
+def atomic_write(path: Path, write_fn, mode: str = "w"):
+    """Write to a temp file in the target directory and move it into place."""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, dir=path.parent)
+    temp_file.close()
+    try:
+        with open(temp_file.name, mode) as f:
+            write_fn(f)
+        os.replace(temp_file.name, path)
+    finally:
+        if os.path.exists(temp_file.name):
+            os.remove(temp_file.name)
+
+
+class FileSink:
+    """Write every document to its own file under `base_dir`."""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        # Created up front so that a run which writes nothing still leaves a trace
+        if not self.base_dir.exists():
+            self.base_dir.mkdir(parents=True)
+
+    def write(self, doc_id: str, text: str):
+        tgt = self.base_dir / doc_id
+        if not tgt.parent.exists():
+            tgt.parent.mkdir(parents=True)
+        with open(tgt, "w") as f:
+            f.write(text or "")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardSink:
+    """Append documents to rolling, size-capped JSONL or Parquet shards.
+
+    Records are buffered in memory and a shard is written atomically once the
+    buffered text reaches `max_shard_bytes`. `index.json` maps every document id
+    to the shard holding it and is rewritten after each shard, so a crashed run
+    leaves only complete shards behind and can be resumed.
+    """
+
+    def __init__(
+        self,
+        base_dir: Path,
+        fmt: Literal["jsonl", "parquet"],
+        max_shard_bytes: int,
+    ):
+        if fmt not in ["jsonl", "parquet"]:
+            raise ValueError("fmt must be either 'jsonl' or 'parquet'")
+        if fmt == "parquet":
+            # Fail before any extraction work is done, not at the first flush
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise ImportError(
+                    "Parquet shards require pyarrow, install it with "
+                    "`poetry install --with publish`"
+                ) from e
+        self.base_dir = base_dir
+        self.fmt = fmt
+        self.max_shard_bytes = max_shard_bytes
+        if not self.base_dir.exists():
+            self.base_dir.mkdir(parents=True)
+
+        self._index_file = self.base_dir / SHARD_INDEX
+        self.index = {}
+        if self._index_file.exists():
+            with open(self._index_file, "r") as f:
+                self.index = json.load(f)
+        self._shard_count = len(set(self.index.values()))
+        self._records = []
+        self._buffered_ids = set()
+        self._buffered_bytes = 0
+
+    def _shard_name(self):
+        return f"{SHARD_PREFIX}{self._shard_count:05d}.{self.fmt}"
+
+    def _write_jsonl(self, f):
+        for record in self._records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _write_parquet(self, f):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([("file_path", pa.string()), ("text", pa.string())])
+        pq.write_table(pa.Table.from_pylist(self._records, schema=schema), f)
+
+    def write(self, doc_id: str, text: str):
+        if doc_id in self:
+            return
+        record = {"file_path": doc_id, "text": text or ""}
+        self._records.append(record)
+        self._buffered_ids.add(doc_id)
+        self._buffered_bytes += len(record["text"].encode("utf-8"))
+        if self._buffered_bytes >= self.max_shard_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        shard_name = self._shard_name()
+        if self.fmt == "jsonl":
+            atomic_write(self.base_dir / shard_name, self._write_jsonl, "w")
+        else:
+            atomic_write(self.base_dir / shard_name, self._write_parquet, "wb")
+
+        for record in self._records:
+            self.index[record["file_path"]] = shard_name
+        atomic_write(
+            self._index_file, lambda f: json.dump(self.index, f, indent=2, sort_keys=True)
+        )
+        logger.info(f"Wrote {len(self._records)} documents to {shard_name}")
+
+        self._shard_count += 1
+        self._records = []
+        self._buffered_ids = set()
+        self._buffered_bytes = 0
+
+    def close(self):
+        self.flush()
+
+    def __contains__(self, doc_id: str):
+        return doc_id in self.index or doc_id in self._buffered_ids
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def make_sink(
+    base_dir: Path,
+    kind: Literal["files", "jsonl", "parquet"],
+    max_shard_bytes: int,
+):
+    if kind == "files":
+        return FileSink(base_dir)
+    return ShardSink(base_dir, kind, max_shard_bytes)
@@ -1,4 +1,5 @@
-from extract import _worker
+from extract import _init_worker, _worker
+from pathlib import Path
 
 src = "data/archives.gov/2017-2018/104-10001-10004.pdf"
 target_dir = "."
@@ -7,4 +8,7 @@ model_name = "gemini-2.0-flash"
 prompt_file = "prompts/extraction/instructions.txt"
 system_prompt_file = "prompts/extraction/system.txt"
 
-_worker(src, target_dir, model_name, prompt_file, system_prompt_file, 4096)
+_init_worker(model_name, prompt_file, system_prompt_file, 4096)
+content = _worker(src)
+with open(Path(target_dir) / Path(src).with_suffix(".md").name, "w") as f:
+    f.write(content or "")
@@ -0,0 +1,241 @@
+"""Sharded extraction end to end, against a pre-filled cache instead of the API.
+
+Run with `python test_sharding.py`.
+"""
+
+from ai.google import get_cache_key
+from extract import _load_pdf_pages
+import json
+from pathlib import Path
+from pypdf import PdfWriter
+import shutil
+from sharding import parse_shard, shard_dir, shard_of, verify_shards
+from sink import FileSink
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = Path(__file__).parent
+NUM_SHARDS = 3
+YEARS = ["2021", "2022"]
+DOCS_PER_YEAR = 8
+PAGES_PER_DOC = 2
+MAX_TOKENS = 4096
+
+
+def _assert_fails(fn, exc_type, match: str):
+    try:
+        fn()
+    except exc_type as e:
+        assert match in str(e), f"{match!r} not in {str(e)!r}"
+    else:
+        raise AssertionError(f"{fn} did not raise {exc_type.__name__}")
+
+
+def _make_workdir(root: Path, sink: str, years=YEARS, docs_per_year=DOCS_PER_YEAR):
+    """Lay out config, secrets, prompts and a cache covering every page of
+    every synthetic PDF. Returns the expected text of each document.
+    """
+    shutil.copytree(REPO_DIR / "prompts", root / "prompts")
+    (root / ".secrets").mkdir()
+    (root / ".secrets/.env").write_text('GEMINI_API_KEY="offline"\n')
+    with open(REPO_DIR / ".config/default.json", "r") as f:
+        config = json.load(f)
+    config["extraction"].update(
+        src_dir=str(root / "src"),
+        dest_dir=str(root / "extracted"),
+        cache_dir=str(root / "cache"),
+        max_tokens=MAX_TOKENS,
+        include_annotation=False,
+        sink=sink,
+        max_shard_bytes=64,
+    )
+    (root / ".config").mkdir()
+    (root / ".config/default.json").write_text(json.dumps(config))
+
+    prompt = (root / config["extraction"]["prompt_file"]).read_text()
+    system_prompt = (root / config["extraction"]["system_prompt_file"]).read_text()
+    cache_dir = root / "cache"
+    cache_dir.mkdir()
+    expected = {}
+    for y, year in enumerate(years):
+        src = root / "src" / year
+        src.mkdir(parents=True)
+        for i in range(docs_per_year):
+            # Distinct page sizes give every page a distinct cache key
+            writer = PdfWriter()
+            for p in range(PAGES_PER_DOC):
+                writer.add_blank_page(100 + 10 * y + i, 100 + p)
+            pdf_file = src / f"doc-{i}.pdf"
+            writer.write(pdf_file)
+
+            pages = []
+            for p, page in enumerate(_load_pdf_pages(pdf_file)):
+                text = f"{year} doc-{i} page-{p}"
+                key = get_cache_key(prompt, system_prompt, [page], MAX_TOKENS)
+                (cache_dir / key).write_text(f"```markdown\n{text}\n```")
+                pages.append(text)
+            expected[f"{year}/doc-{i}.md"] = "\n\n".join(pages)
+    return expected
+
+
+def _run_extract(root: Path, *args):
+    return subprocess.Popen(
+        [sys.executable, str(REPO_DIR / "extract.py"), *args],
+        cwd=root,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def _run_shards_and_merge(root: Path):
+    procs = [_run_extract(root, "--shard", f"{i}/{NUM_SHARDS}") for i in range(NUM_SHARDS)]
+    for proc in procs:
+        _, err = proc.communicate()
+        assert proc.returncode == 0, err
+    proc = _run_extract(root, "merge", str(NUM_SHARDS))
+    _, err = proc.communicate()
+    assert proc.returncode == 0, err
+
+
+def test_parse_shard():
+    assert parse_shard("0/1") == (0, 1)
+    assert parse_shard("2/8") == (2, 8)
+    for spec in ["8/8", "-1/8", "1/0", "a/b", "3", "1/2/3"]:
+        _assert_fails(lambda: parse_shard(spec), ValueError, "")
+
+
+def test_shard_of_is_stable():
+    # Fixed values: the assignment must not change across runs or machines
+    assert [shard_of(f"2021/doc-{i}.pdf", 4) for i in range(8)] == [2, 1, 0, 0, 2, 1, 3, 1]
+    assert all(shard_of(f"2021/doc-{i}.pdf", 1) == 0 for i in range(8))
+
+
+def test_verify_shards_failures():
+    expected = {
+        f"2021/doc-{i}.md": shard_of(f"2021/doc-{i}.pdf", NUM_SHARDS)
+        for i in range(DOCS_PER_YEAR)
+    }
+    doc_ids = list(expected)
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = Path(tmp) / "extracted"
+
+        def _write_shards(extra=()):
+            for i in range(NUM_SHARDS):
+                shutil.rmtree(shard_dir(dest, i, NUM_SHARDS), ignore_errors=True)
+                sink = FileSink(shard_dir(dest, i, NUM_SHARDS))
+                for doc_id, owner in expected.items():
+                    if owner == i:
+                        sink.write(doc_id, doc_id)
+            for doc_id, index in extra:
+                FileSink(shard_dir(dest, index, NUM_SHARDS)).write(doc_id, doc_id)
+
+        _write_shards()
+        found = verify_shards(expected, dest, NUM_SHARDS, "files")
+        assert sorted(sum(found.values(), [])) == sorted(doc_ids)
+
+        _assert_fails(
+            lambda: verify_shards(
+                {**expected, "2021/absent.md": 0}, dest, NUM_SHARDS, "files"
+            ),
+            RuntimeError,
+            "1 missing",
+        )
+
+        owner = expected[doc_ids[0]]
+        other = (owner + 1) % NUM_SHARDS
+        _write_shards(extra=[(doc_ids[0], other)])
+        _assert_fails(
+            lambda: verify_shards(expected, dest, NUM_SHARDS, "files"),
+            RuntimeError,
+            "1 duplicated",
+        )
+
+        _write_shards()
+        (shard_dir(dest, owner, NUM_SHARDS) / doc_ids[0]).unlink()
+        FileSink(shard_dir(dest, other, NUM_SHARDS)).write(doc_ids[0], "")
+        _assert_fails(
+            lambda: verify_shards(expected, dest, NUM_SHARDS, "files"),
+            RuntimeError,
+            "1 in the wrong shard",
+        )
+
+        shutil.rmtree(shard_dir(dest, 0, NUM_SHARDS))
+        _assert_fails(
+            lambda: verify_shards(expected, dest, NUM_SHARDS, "files"),
+            FileNotFoundError,
+            "shard 0",
+        )
+
+
+def test_sharded_extraction_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        expected = _make_workdir(root, "files")
+        _run_shards_and_merge(root)
+
+        extracted = root / "extracted"
+        found = {
+            str(f.relative_to(extracted)): f.read_text()
+            for f in extracted.rglob("*")
+            if f.is_file()
+        }
+        assert found == expected
+        # Every page was served from the canonical cache
+        for i in range(NUM_SHARDS):
+            assert not any(shard_dir(root / "cache", i, NUM_SHARDS).iterdir())
+
+
+def test_sharded_extraction_files_empty_shard():
+    # Shards that write nothing still leave a directory, so merge can tell them
+    # apart from shards that never ran
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        expected = _make_workdir(root, "files", years=YEARS[:1], docs_per_year=1)
+        _run_shards_and_merge(root)
+
+        extracted = root / "extracted"
+        found = {
+            str(f.relative_to(extracted)): f.read_text()
+            for f in extracted.rglob("*")
+            if f.is_file()
+        }
+        assert found == expected
+
+
+def _read_jsonl_output(extracted: Path):
+    with open(extracted / "index.json", "r") as f:
+        index = json.load(f)
+    found = {}
+    for shard_name in sorted(set(index.values())):
+        with open(extracted / shard_name, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                assert index[record["file_path"]] == shard_name
+                found[record["file_path"]] = record["text"]
+    return found
+
+
+def test_sharded_extraction_jsonl():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        expected = _make_workdir(root, "jsonl")
+        _run_shards_and_merge(root)
+        assert _read_jsonl_output(root / "extracted") == expected
+
+
+def test_sharded_extraction_jsonl_empty_shard():
+    # A single document leaves all but one shard without an index.json
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        expected = _make_workdir(root, "jsonl", years=YEARS[:1], docs_per_year=1)
+        _run_shards_and_merge(root)
+        assert _read_jsonl_output(root / "extracted") == expected
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_") and callable(fn):
+            fn()
+            print(f"{name} passed")